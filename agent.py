@@ -15,7 +15,7 @@ from livekit.agents import (
 )
 from livekit.agents.multimodal import MultimodalAgent
 from livekit.plugins import openai
-import json  # Import JSON for serialization
+import orjson  # Fast JSON for RPC payloads and incoming frontend data
 import asyncio
 
 # Load environment variables
@@ -25,6 +25,46 @@ logger = logging.getLogger("my-worker")
 logger.setLevel(logging.INFO)
 
 frontendData = {}
+global_chat_ctx: llm.ChatContext | None = None
+
+# Incoming frontend packets are buffered and merged in batches of up to DATA_BATCH_SIZE
+DATA_QUEUE_SIZE = 256
+DATA_BATCH_SIZE = 64
+
+# Frontend fields kept in frontendData; other keys and oversized values are dropped
+FRONTEND_KEYS = frozenset({"current_exercise", "exercise", "reps", "Yes"})
+FRONTEND_MAX_VALUE_LEN = 256
+
+# RPC methods registered by the Swift app
+RPC_SELECT_EXERCISE = "select_exercise"
+RPC_START_GAME = "start_game"
+RPC_CHANGE_REPS = "change_reps"
+RPC_EXIT_GAME = "exit_game"
+RPC_SKIP_REST = "skip_rest"
+
+# Prompt pieces for the realtime model, built once per process
+INSTRUCTIONS = (
+    "You are a voice assistant created by Plai Lab at Olin College of Engineering."
+    "Your task is to help older people rehabilitate through exercise."
+    "You will call functions based on what the user says."
+    "When the person is exercising, based off the exercise, check on them and ask if they are doing okay"
+    "If the form of a user is bad, give some feedback based off the exercise" # we need to do each of this individually
+    # We need to do a form checker because I don't trust vision and we don't have vision input with realtime agent...
+
+    "Whenever the user starts doing an exercise, instruct them to refer to the animation for how to do it, move your exercising body parts to follow the elements on the screen, and that they can ask to skip rest"
+
+    # STUFF WILL NEED TO BE PROMPTED BETTER IN THE FUTURE
+)
+
+GREETING = (
+    "When you are initialized, say the following exactly as written, without adding or changing anything:"
+    "Welcome! Let me guide you through the app. "
+    "You can talk to me directly through voice to start exercises on this app. Tap 'Play Start Exercising' to begin your workout, use 'Next Exercise' to explore different exercises, "
+    "and adjust the slider to set the number of reps per set. The exercises available are: "
+    "['Shoulder Raises', 'Leg Raises', 'Cross Body Reach']. Let's get started! "
+)
+
+MODALITIES = ("audio", "text")
 
 class AssistantFnc(llm.FunctionContext):
     """
@@ -39,6 +79,60 @@ class AssistantFnc(llm.FunctionContext):
         super().__init__()
         self.ctx = ctx  # Store the context
 
+        # Identities of the participants RPCs go to, kept in sync with the room
+        self._dst_identities: tuple[str, ...] | None = None
+        self._refresh_participants()
+        ctx.room.on("participant_connected", self._refresh_participants)
+        ctx.room.on("participant_disconnected", self._refresh_participants)
+
+    def _refresh_participants(self, participant: rtc.RemoteParticipant | None = None):
+        """Rebuild the cached RPC destinations from the participants currently in the room."""
+        identities = tuple(p.identity for p in self.ctx.room.remote_participants.values())
+        self._dst_identities = identities or None
+
+    async def _rpc(self, method: str, data: dict) -> bool:
+        """
+        Description: Serializes data once and sends it as an RPC to every remote participant concurrently
+        Args:
+        method (string): the RPC method registered on the Swift side
+        data (dict): the fields to send as the JSON payload
+
+        Returns:
+        True if at least one participant received the RPC; failures for the others are logged
+        """
+
+        # If there is no one, don't do anything
+        identities = self._dst_identities
+        if not identities:
+            logger.warning("No remote participants available for %s.", method)
+            return False
+
+        payload = orjson.dumps(data).decode()  # perform_rpc expects a JSON string
+        logger.debug("Sending RPC with payload: %s", payload)
+
+        results = await asyncio.gather(
+            *(
+                self.ctx.room.local_participant.perform_rpc(
+                    destination_identity=identity,
+                    method=method,
+                    payload=payload,
+                )
+                for identity in identities
+            ),
+            return_exceptions=True,
+        )
+
+        delivered = False
+        for identity, result in zip(identities, results):
+            # CancelledError is a BaseException, so a cancelled RPC must not count as delivered
+            if isinstance(result, BaseException):
+                logger.error("Failed to send RPC to Swift (%s): %s", identity, result)
+            else:
+                delivered = True
+        if delivered:
+            logger.info("Sent %s to Swift", method)
+        return delivered
+
     @llm.ai_callable()
     async def select_exercise(
         self,
@@ -53,31 +147,7 @@ class AssistantFnc(llm.FunctionContext):
         exercise (string): the exercise the user asked for out of the available exercises
         """
 
-        # If there is no one, don't do anything
-        if not self.ctx.room.remote_participants: 
-            logger.warning("No remote participants available to start the game.")
-            return
-        
-        # There will only be one person at a time
-        remote_participant = list(self.ctx.room.remote_participants.values())[0]
-
-        try:
-            payload = json.dumps({
-                "exercise": exercise
-            })
-
-            logger.info(f"Sending RPC with payload: {payload}")
-
-            await self.ctx.room.local_participant.perform_rpc(
-                destination_identity=remote_participant.identity,
-                method="select_exercise",
-                payload=payload  # Ensure it's a JSON string
-            )
-            logger.info(f"Sent exercise to Swift: {exercise}")
-
-            return 
-        except Exception as e:
-            logger.error(f"Failed to send RPC to Swift: {e}")
+        await self._rpc(RPC_SELECT_EXERCISE, {"exercise": exercise})
 
     @llm.ai_callable()
     async def start_game(
@@ -97,32 +167,10 @@ class AssistantFnc(llm.FunctionContext):
         happiness (when it works)
         """
 
-        # If there is no one, don't do anything
-        if not self.ctx.room.remote_participants: 
-            logger.warning("No remote participants available to start the game.")
+        if not await self._rpc(RPC_START_GAME, {"Yes": Yes}):
             return
 
-        # There will only be one person at a time
-        remote_participant = list(self.ctx.room.remote_participants.values())[0]
-
-        try:
-            payload = json.dumps({  # Ensure JSON serialization
-                "Yes": Yes
-            })
-
-            logger.info(f"Sending RPC with payload: {payload}")
-
-            await self.ctx.room.local_participant.perform_rpc(
-                destination_identity=remote_participant.identity,
-                method="start_game",
-                payload=payload  # Ensure it's a JSON string
-            )
-
-            logger.info(f"Sent start game to Swift: {Yes}")
-            return json.dumps(frontendData)
-
-        except Exception as e:
-            logger.error(f"Failed to send RPC to Swift: {e}")
+        return orjson.dumps(frontendData).decode()
 
     @llm.ai_callable()
     async def change_reps(
@@ -142,31 +190,7 @@ class AssistantFnc(llm.FunctionContext):
         happiness (when it works)
         """
 
-        # If there is no one, don't do anything
-        if not self.ctx.room.remote_participants: 
-            logger.warning("No remote participants available to start the game.")
-            return
-
-        # There will only be one person at a time
-        remote_participant = list(self.ctx.room.remote_participants.values())[0]
-
-        try:
-            payload = json.dumps({  # Ensure JSON serialization
-                "reps": reps
-            })
-
-            logger.info(f"Sending RPC with payload: {payload}")
-
-            await self.ctx.room.local_participant.perform_rpc(
-                destination_identity=remote_participant.identity,
-                method="change_reps",
-                payload=payload  # Ensure it's a JSON string
-            )
-
-            logger.info(f"Sent rep number: {reps}")
-
-        except Exception as e:
-            logger.error(f"Failed to send RPC to Swift: {e}")
+        await self._rpc(RPC_CHANGE_REPS, {"reps": reps})
 
 
     @llm.ai_callable()
@@ -187,31 +211,7 @@ class AssistantFnc(llm.FunctionContext):
         happiness (when it works)
         """
 
-        # If there is no one, don't do anything
-        if not self.ctx.room.remote_participants: 
-            logger.warning("No remote participants available to start the game.")
-            return
-
-        # There will only be one person at a time
-        remote_participant = list(self.ctx.room.remote_participants.values())[0]
-
-        try:
-            payload = json.dumps({  # Ensure JSON serialization
-                "Yes": Yes
-            })
-
-            logger.info(f"Sending RPC with payload: {payload}")
-
-            await self.ctx.room.local_participant.perform_rpc(
-                destination_identity=remote_participant.identity,
-                method="exit_game",
-                payload=payload  # Ensure it's a JSON string
-            )
-
-            logger.info(f"Sent exit game to Swift: {Yes}")
-
-        except Exception as e:
-            logger.error(f"Failed to send RPC to Swift: {e}")
+        await self._rpc(RPC_EXIT_GAME, {"Yes": Yes})
 
     @llm.ai_callable()
     async def skip_rest(
@@ -231,73 +231,99 @@ class AssistantFnc(llm.FunctionContext):
         happiness (when it works)
         """
 
-        # If there is no one, don't do anything
-        if not self.ctx.room.remote_participants: 
-            logger.warning("No remote participants available to start the game.")
-            return
+        await self._rpc(RPC_SKIP_REST, {"Yes": Yes})
 
-        # There will only be one person at a time
-        remote_participant = list(self.ctx.room.remote_participants.values())[0]
 
-        try:
-            payload = json.dumps({  # Ensure JSON serialization
-                "Yes": Yes
-            })
+def apply_frontend_data(parsed_data: dict):
+    """Merges a batch of frontend updates into frontendData and tells the LLM what changed."""
+    logger.debug("Parsed data: %s", parsed_data)
 
-            logger.info(f"Sending RPC with payload: {payload}")
+    frontendData.update(parsed_data)
+    logger.debug("Updated frontendData: %s", frontendData)
 
-            await self.ctx.room.local_participant.perform_rpc(
-                destination_identity=remote_participant.identity,
-                method="skip_rest",
-                payload=payload  # Ensure it's a JSON string
+    # Now, inject into chat context in a *readable* way
+    if global_chat_ctx is not None:
+        if 'current_exercise' in parsed_data:
+            exercise = parsed_data['current_exercise']
+            global_chat_ctx.append(
+                text=f"The user has selected the exercise: {exercise}.",
+                role="system"
             )
+            logger.info("Appended exercise update to chat context: %s", exercise)
+
+        if 'reps' in parsed_data:
+            reps = parsed_data['reps']
+            global_chat_ctx.append(
+                text=f"The user set the number of repetitions per set to {reps}.",
+                role="system"
+            )
+            logger.info("Appended reps update to chat context: %s", reps)
+
+        # You can add more handling here if you want to support more frontend fields
 
-            logger.info(f"Sent exit game to Swift: {Yes}")
 
-        except Exception as e:
-            logger.error(f"Failed to send RPC to Swift: {e}")
-            
 async def entrypoint(ctx: JobContext):
     """Main entrypoint for connecting the agent to the LiveKit room."""
-    logger.info(f"Connecting to room: {ctx.room.name}")
-    logger.info(f"LiveKit server URL: {ctx.room.isconnected()}")  # Log server URL
+    logger.info("Connecting to room: %s", ctx.room.name)
+    logger.info("LiveKit server URL: %s", ctx.room.isconnected())  # Log server URL
+
+    # Packets are queued and applied in batches by one task instead of a task per packet
+    data_queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=DATA_QUEUE_SIZE)
+
+    async def drain_data():
+        while True:
+            batch = [await data_queue.get()]
+            while not data_queue.empty() and len(batch) < DATA_BATCH_SIZE:
+                batch.append(data_queue.get_nowait())
+
+            merged = {}
+            for raw in batch:
+                try:
+                    merged.update(orjson.loads(raw))
+                except Exception as e:
+                    logger.error("Failed to parse incoming data: %s", e)
+
+            accepted = {}
+            unknown = []
+            oversized = []
+            for k, v in merged.items():
+                if k not in FRONTEND_KEYS:
+                    unknown.append(k)
+                elif len(str(v)) >= FRONTEND_MAX_VALUE_LEN:
+                    oversized.append(k)
+                else:
+                    accepted[k] = v
+
+            # The frontend may routinely send fields the agent doesn't use
+            if unknown:
+                logger.debug("Ignored unknown frontend fields: %s", unknown)
+            if oversized:
+                logger.warning(
+                    "Dropped frontend fields with values of %d+ characters: %s",
+                    FRONTEND_MAX_VALUE_LEN,
+                    oversized,
+                )
+
+            if accepted:
+                try:
+                    apply_frontend_data(accepted)
+                except Exception as e:
+                    logger.error("Failed to handle incoming data: %s", e)
+
+    drain_task = asyncio.create_task(drain_data())
+
+    async def stop_drain():
+        drain_task.cancel()
+
+    ctx.add_shutdown_callback(stop_drain)
 
     @ctx.room.on("data_received")
     def on_data_received(data: rtc.DataPacket):
-        async def handle_data():
-            try:
-                logger.info(f"Raw data received: {data}")
-                parsed_data = json.loads(data.data)
-                logger.info(f"Parsed data: {parsed_data}")
-
-                frontendData.update(parsed_data)
-                logger.info(f"Updated frontendData: {frontendData}")
-
-                # Now, inject into chat context in a *readable* way
-                if global_chat_ctx is not None:
-                    if 'current_exercise' in parsed_data:
-                        exercise = parsed_data['current_exercise']
-                        global_chat_ctx.append(
-                            text=f"The user has selected the exercise: {exercise}.",
-                            role="system"
-                        )
-                        logger.info(f"Appended exercise update to chat context: {exercise}")
-
-                    if 'reps' in parsed_data:
-                        reps = parsed_data['reps']
-                        global_chat_ctx.append(
-                            text=f"The user set the number of repetitions per set to {reps}.",
-                            role="system"
-                        )
-                        logger.info(f"Appended reps update to chat context: {reps}")
-
-                    # You can add more handling here if you want to support more frontend fields
-
-            except Exception as e:
-                logger.error(f"Failed to handle incoming data: {e}")
-
-        
-        asyncio.create_task(handle_data())
+        logger.debug("Raw data received: %s", data)
+        try:
+            data_queue.put_nowait(data.data)
+        except asyncio.QueueFull:
+            logger.warning("Frontend data queue is full, dropping packet.")
 
     @ctx.room.on("track_subscribed")
     def on_track_subscribed(
@@ -305,11 +331,15 @@ async def entrypoint(ctx: JobContext):
         publication: rtc.TrackPublication,
         participant: rtc.RemoteParticipant,
     ):
-        logger.info(f"Track subscribed: {track.kind} from participant {participant.identity}")
+        logger.info("Track subscribed: %s from participant %s", track.kind, participant.identity)
 
     # Connect to the room (auto-subscribe to all tracks)
     await ctx.connect(auto_subscribe=AutoSubscribe.SUBSCRIBE_ALL)
-    logger.info(f"Connected to LiveKit! Room: {ctx.room.name}, Participants: {len(ctx.room.remote_participants)}")
+    logger.info(
+        "Connected to LiveKit! Room: %s, Participants: %d",
+        ctx.room.name,
+        len(ctx.room.remote_participants),
+    )
 
     participant = await ctx.wait_for_participant()
     run_multimodal_agent(ctx, participant)
@@ -322,32 +352,12 @@ def run_multimodal_agent(ctx: JobContext, participant: rtc.RemoteParticipant):
     logger.info("Starting multimodal agent...")
     global global_chat_ctx
     model = openai.realtime.RealtimeModel(
-        instructions=(
-            "You are a voice assistant created by Plai Lab at Olin College of Engineering."
-            "Your task is to help older people rehabilitate through exercise."
-            "You will call functions based on what the user says."
-            "When the person is exercising, based off the exercise, check on them and ask if they are doing okay"
-            "If the form of a user is bad, give some feedback based off the exercise" # we need to do each of this individually
-            # We need to do a form checker because I don't trust vision and we don't have vision input with realtime agent...
-
-            "Whenever the user starts doing an exercise, instruct them to refer to the animation for how to do it, move your exercising body parts to follow the elements on the screen, and that they can ask to skip rest"
-
-            # STUFF WILL NEED TO BE PROMPTED BETTER IN THE FUTURE
-        ),
-        modalities=["audio", "text"],
+        instructions=INSTRUCTIONS,
+        modalities=list(MODALITIES),  # the plugin expects its own list
     )
 
     chat_ctx = llm.ChatContext()
-    chat_ctx.append(
-        text=(
-            "When you are initialized, say the following exactly as written, without adding or changing anything:"
-            "Welcome! Let me guide you through the app. "
-            "You can talk to me directly through voice to start exercises on this app. Tap 'Play Start Exercising' to begin your workout, use 'Next Exercise' to explore different exercises, "
-            "and adjust the slider to set the number of reps per set. The exercises available are: "
-            "['Shoulder Raises', 'Leg Raises', 'Cross Body Reach']. Let's get started! "
-        ),
-        role="assistant",
-    )
+    chat_ctx.append(text=GREETING, role="assistant")
     global_chat_ctx = chat_ctx
 
     # Pass `ctx` to AssistantFnc so it has access to JobContext for RPC calls